@@ -0,0 +1,477 @@
+import os
+import shutil
+import json
+import gc
+import time
+import hashlib
+import asyncio
+import math
+import pickle
+import logging
+import sys
+import tempfile
+import glob
+from fastapi import FastAPI, UploadFile, File, HTTPException
+from pydantic import BaseModel
+
+# orjson is a much faster JSON parser/serializer; fall back to stdlib json if missing
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse as DefaultResponse
+except ImportError:
+    orjson = None
+    from fastapi.responses import JSONResponse as DefaultResponse
+
+# LangChain components
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_community.docstore.in_memory import InMemoryDocstore
+import faiss
+import numpy as np
+import fitz  # PyMuPDF
+
+# --- Logging Setup ---
+# INFO by default; set the "doc_api" logger to DEBUG to trace queries. Log calls use
+# %-style arguments so disabled messages are never formatted.
+logging.basicConfig(level=logging.INFO)
+
+log = logging.getLogger("doc_api")
+log.setLevel(logging.INFO)
+
+ch = logging.StreamHandler(sys.stdout)
+ch.setLevel(logging.DEBUG)
+
+formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+ch.setFormatter(formatter)
+
+if not log.hasHandlers():
+    log.addHandler(ch)
+
+# --- Persistent Storage Settings ---
+STORE_HASH_FILE = ".sha"  # SHA-256 of the PDF the persisted store was built from
+
+# --- Embedding Settings ---
+EMBED_BATCH_SIZE = 64  # Chunks sent per embedding request
+EMBED_CONCURRENCY = 8  # Embedding requests in flight at once
+
+# --- Chunking Settings ---
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+MIN_CHUNK_SIZE = 100          # Shorter chunks are merged into a neighbour
+MAX_MERGED_CHUNK_SIZE = 1150  # Upper bound for a merged chunk
+
+# --- HNSW Index Settings ---
+HNSW_M = 32                 # Graph neighbours per vector
+HNSW_EF_CONSTRUCTION = 200  # Build-time search depth (index quality)
+HNSW_EF_SEARCH = 64         # Query-time search depth (accuracy/latency trade-off)
+
+# --- IVF-PQ Index Settings (large documents only) ---
+IVFPQ_MIN_VECTORS = 10000   # Below this, HNSW over full vectors is small enough
+IVFPQ_M = 8                 # Sub-quantizers per vector (must divide the embedding size)
+IVFPQ_NBITS = 8             # Bits per sub-quantizer code
+IVF_NPROBE = 8              # Inverted lists scanned per query
+
+# --- Pydantic Models ---
+class QueryModel(BaseModel):
+    question: str
+
+class QueryResponse(BaseModel):
+    decision: str
+    amount: int
+    justification: list
+
+# --- Prompt ---
+# The prompt is pre-split around its two inputs, so building it is plain string concatenation
+PROMPT_PREFIX = """
+You are an expert insurance claims processor. Your task is to evaluate a user's query based ONLY on the provided policy clauses.
+Do not use any external knowledge.
+Provide your response in a structured JSON format with the following keys: "decision", "amount", and "justification".
+The justification list should contain objects, each with a "finding" and "clause_text" key.
+If an amount is not applicable, set it to 0.
+
+CONTEXT (Policy Clauses):
+"""
+PROMPT_MIDDLE = """
+
+QUERY:
+"""
+PROMPT_SUFFIX = """
+
+JSON RESPONSE:
+"""
+
+# Built once and reused for every upload
+text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+
+# --- Helper Functions ---
+def parse_llm_json(raw):
+    """
+    Parses the LLM's JSON-mode response.
+    Uses orjson when installed, retrying with stdlib json (which also accepts NaN/Infinity) if it fails.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(raw.encode())
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(raw)
+
+
+def force_delete_directory(path):
+    """
+    Robustly deletes a directory, retrying on Windows-specific file lock errors.
+    """
+    if not os.path.exists(path):
+        return
+
+    retries = 5
+    delay = 0.5  # Start with a 500ms delay
+    for i in range(retries):
+        try:
+            shutil.rmtree(path)
+            return
+        except PermissionError as e:
+            if "WinError 32" in str(e) and i < retries - 1:
+                time.sleep(delay)
+                delay *= 2  # Double the delay each time
+            else:
+                raise e
+        except Exception as e:
+            raise e
+
+
+def post_merge(chunks):
+    """
+    Merges chunks shorter than MIN_CHUNK_SIZE into the previous chunk from the same page
+    as long as the result stays within MAX_MERGED_CHUNK_SIZE.
+    """
+    merged = []
+    for chunk in chunks:
+        if merged and merged[-1].metadata == chunk.metadata:
+            previous = merged[-1]
+            is_small = len(chunk.page_content) < MIN_CHUNK_SIZE or len(previous.page_content) < MIN_CHUNK_SIZE
+            fits = len(previous.page_content) + 1 + len(chunk.page_content) <= MAX_MERGED_CHUNK_SIZE
+            if is_small and fits:
+                merged[-1] = Document(
+                    page_content=previous.page_content + "\n" + chunk.page_content,
+                    metadata=previous.metadata
+                )
+                continue
+        merged.append(chunk)
+    return merged
+
+
+def load_chunks(file_bytes, filename):
+    """
+    Parses the uploaded PDF bytes in memory and splits them into chunks.
+    This is blocking (PDF parsing), so it runs in a worker thread.
+    """
+    # 1. Load Document (PyMuPDF, one Document per page)
+    with fitz.open(stream=file_bytes, filetype="pdf") as pdf:
+        documents = [
+            Document(page_content=page.get_text("text"), metadata={"page": i, "source": filename})
+            for i, page in enumerate(pdf)
+        ]
+
+    # 2. Chunk Documents
+    return post_merge(text_splitter.split_documents(documents))
+
+
+async def embed_texts(embeddings, texts):
+    """
+    Embeds texts in batches of EMBED_BATCH_SIZE, with up to EMBED_CONCURRENCY batch requests in flight.
+    """
+    semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+
+    async def embed_batch(batch):
+        async with semaphore:
+            return await asyncio.to_thread(embeddings.embed_documents, batch)
+
+    batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+    results = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+    return [vector for batch_vectors in results for vector in batch_vectors]
+
+
+def tune_index(index):
+    """
+    Applies the query-time search settings for the given index type.
+    Other index types (e.g. flat indexes saved by older versions) are left as they are.
+    """
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = IVF_NPROBE
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+
+
+def distance_strategy(index):
+    """
+    Returns the LangChain distance strategy matching the index's metric.
+    """
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        return DistanceStrategy.MAX_INNER_PRODUCT
+    return DistanceStrategy.EUCLIDEAN_DISTANCE
+
+
+def build_vectorstore(embeddings, texts, vectors, metadatas):
+    """
+    Builds a FAISS store from precomputed embeddings.
+    Large documents get a compressed IVF-PQ index; everything else an HNSW graph index.
+    Vectors are L2-normalized so results are ranked by cosine similarity. HNSW searches them by
+    inner product; IVF-PQ keeps L2, which ranks unit vectors identically and quantizes more accurately.
+    Query vectors must be normalized the same way (see normalize_query).
+    """
+    matrix = np.array(vectors, dtype=np.float32)
+    faiss.normalize_L2(matrix)
+
+    dim = matrix.shape[1]
+    if len(matrix) >= IVFPQ_MIN_VECTORS and dim % IVFPQ_M == 0:
+        nlist = max(32, int(4 * math.sqrt(len(matrix))))
+        quantizer = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, IVFPQ_M, IVFPQ_NBITS)
+        index.train(matrix)
+    else:
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    tune_index(index)
+
+    vectorstore = FAISS(
+        embeddings, index, InMemoryDocstore(), {},
+        distance_strategy=distance_strategy(index)
+    )
+    vectorstore.add_embeddings(list(zip(texts, matrix)), metadatas=metadatas)
+    return vectorstore
+
+
+def normalize_query(vector, index):
+    """
+    L2-normalizes a query embedding so it is compared to the stored unit vectors by cosine similarity.
+    Flat indexes saved by older versions hold raw vectors, so their queries are left as they are.
+    """
+    if isinstance(index, faiss.IndexFlat):
+        return vector
+    query = np.array([vector], dtype=np.float32)
+    faiss.normalize_L2(query)
+    return query[0].tolist()
+
+
+def read_store_hash(store_dir):
+    """
+    Returns the SHA-256 of the PDF the persisted store was built from, or None if there is none.
+    """
+    try:
+        with open(os.path.join(store_dir, STORE_HASH_FILE)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def save_vectorstore(embeddings, store_dir, file_hash, texts, vectors, metadatas):
+    """
+    Builds a vector store from the given embeddings and saves it into a new staging directory
+    next to store_dir, leaving the persisted store untouched. Returns the store and the staging directory.
+    This is blocking (disk and index building), so it runs in a worker thread.
+    """
+    vectorstore = build_vectorstore(embeddings, texts, vectors, metadatas)
+
+    store_path = os.path.abspath(store_dir)
+    staging_dir = tempfile.mkdtemp(prefix=os.path.basename(store_path) + ".staging-", dir=os.path.dirname(store_path))
+    try:
+        # Save FAISS index to disk
+        vectorstore.save_local(staging_dir)
+        # Written last, so it only exists for a completely saved store
+        with open(os.path.join(staging_dir, STORE_HASH_FILE), "w") as f:
+            f.write(file_hash)
+    except Exception:
+        force_delete_directory(staging_dir)
+        raise
+    return vectorstore, staging_dir
+
+
+def swap_store_directory(staging_dir, store_dir):
+    """
+    Moves a staged store into place and returns the directory holding the previous one
+    (staging_dir + ".old"), which the caller deletes once it is no longer in use.
+    If the staged store cannot be moved, the previous one is put back.
+    """
+    retired_dir = staging_dir + ".old"
+    if os.path.exists(store_dir):
+        os.replace(store_dir, retired_dir)
+    try:
+        os.replace(staging_dir, store_dir)
+    except Exception:
+        # Put the previous store back so queries keep working
+        if os.path.exists(retired_dir):
+            os.replace(retired_dir, store_dir)
+        raise
+    return retired_dir
+
+
+def read_vectorstore(embeddings, store_dir):
+    """
+    Reads the persisted FAISS store, memory-mapping the index data instead of copying it into the heap
+    (IVF inverted lists via IO_FLAG_MMAP, flat/HNSW vector codes via IO_FLAG_MMAP_IFC).
+    Returns None if no document has been processed yet.
+    """
+    index_path = os.path.join(store_dir, "index.faiss")
+    if not os.path.exists(index_path):
+        return None
+
+    try:
+        index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        # IVF stores: the on-disk inverted lists reader cannot be combined with IO_FLAG_MMAP_IFC
+        index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    tune_index(index)
+    with open(os.path.join(store_dir, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(
+        embeddings, index, docstore, index_to_docstore_id,
+        distance_strategy=distance_strategy(index)
+    )
+
+
+# --- App Factory ---
+def build_app(get_llm, get_embeddings, store_dir, title="Document Processing API"):
+    """
+    Builds the document processing API around the given vector store directory.
+    get_llm and get_embeddings are cached factories, called on first use (in a worker
+    thread, as constructing a client may block) so they are not built at import time.
+    """
+    app = FastAPI(title=title, default_response_class=DefaultResponse)
+
+    # Ensure directories exist
+    os.makedirs(store_dir, exist_ok=True)
+
+    # --- Vector Store Cache ---
+    # The index is read-only between uploads, so it is loaded once and shared by every query.
+    app.state.vectorstore = None
+    app.state.vectorstore_generation = 0
+    vectorstore_lock = asyncio.Lock()
+
+    async def load_vectorstore():
+        """
+        Returns the cached vector store, reading it from disk on first use.
+        """
+        # Fast path: once populated, the cache is only ever replaced as a whole, never mutated
+        vectorstore = app.state.vectorstore
+        if vectorstore is not None:
+            return vectorstore
+
+        async with vectorstore_lock:
+            if app.state.vectorstore is None:
+                app.state.vectorstore = await asyncio.to_thread(lambda: read_vectorstore(get_embeddings(), store_dir))
+            return app.state.vectorstore
+
+    @app.post("/upload")
+    async def upload_and_process_pdf(file: UploadFile = File(...)):
+        """
+        Handles PDF upload, processing, and vector store creation.
+        This function overwrites any existing database.
+        """
+        try:
+            file_bytes = await file.read()
+            file_hash = (await asyncio.to_thread(hashlib.sha256, file_bytes)).hexdigest()
+
+            # Same PDF as the persisted store: nothing to rebuild
+            if await asyncio.to_thread(read_store_hash, store_dir) == file_hash:
+                log.debug("File '%s' unchanged (sha256 %s); reusing vector store.", file.filename, file_hash)
+                return {"status": "success", "message": f"File '{file.filename}' processed successfully."}
+
+            # Parse, embed and build into a staging directory without holding the cache lock,
+            # so queries keep being served from the current store meanwhile
+            chunks = await asyncio.to_thread(load_chunks, file_bytes, file.filename)
+            if not chunks:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"No extractable text found in '{file.filename}' (is it a scanned PDF?)."
+                )
+            embeddings = await asyncio.to_thread(get_embeddings)
+
+            # 3. Embed chunks in concurrent batches and store in FAISS
+            texts = [chunk.page_content for chunk in chunks]
+            metadatas = [chunk.metadata for chunk in chunks]
+            vectors = await embed_texts(embeddings, texts)
+            vectorstore, staging_dir = await asyncio.to_thread(
+                save_vectorstore, embeddings, store_dir, file_hash, texts, vectors, metadatas
+            )
+
+            # Hold the cache lock only to swap the directory and the cached store
+            async with vectorstore_lock:
+                # Drop the cached store and collect once so its memory-mapped index file
+                # is closed before the directory is moved (avoids WinError 32)
+                app.state.vectorstore = None
+                gc.collect()
+                try:
+                    await asyncio.to_thread(swap_store_directory, staging_dir, store_dir)
+                except Exception:
+                    await asyncio.to_thread(force_delete_directory, staging_dir)
+                    raise
+
+                # Serve queries from the freshly built store
+                app.state.vectorstore = vectorstore
+                app.state.vectorstore_generation += 1
+                log.info("Vector store replaced (generation %d).", app.state.vectorstore_generation)
+
+            # Best effort: the new store is already live, so a leftover directory must not fail the upload.
+            # Directories left behind by earlier uploads (e.g. still mapped by a query) are retried too.
+            for path in glob.glob(os.path.abspath(store_dir) + ".staging-*.old"):
+                try:
+                    await asyncio.to_thread(force_delete_directory, path)
+                except Exception as e:
+                    log.warning("Could not delete previous vector store directory '%s': %s", path, e)
+
+            return {"status": "success", "message": f"File '{file.filename}' processed successfully."}
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
+
+    @app.post("/query", response_model=QueryResponse)
+    async def query_document(query: QueryModel):
+        """
+        Handles user queries against the processed vector store.
+        """
+        log.debug("--- Received query for: %s ---", query.question)
+        try:
+            # 1. Get the cached vector store (loaded from disk on first use)
+            vectorstore = await load_vectorstore()
+            if vectorstore is None:
+                log.warning("Vector store not found.")
+                raise HTTPException(status_code=400, detail="No document has been uploaded and processed yet.")
+
+            # 2. Embed the question once and retrieve the most relevant policy clauses
+            query_vector = await asyncio.to_thread(lambda: get_embeddings().embed_query(query.question))
+            query_vector = normalize_query(query_vector, vectorstore.index)
+            docs = await asyncio.to_thread(vectorstore.similarity_search_by_vector, query_vector, k=5)
+            context = "\n\n".join(doc.page_content for doc in docs)
+
+            # 3. Invoke the LLM and Get Response
+            message = PROMPT_PREFIX + context + PROMPT_MIDDLE + query.question + PROMPT_SUFFIX
+            raw_response = await asyncio.to_thread(lambda: get_llm().invoke(message).text)
+            log.debug("Received raw response from LLM:\n%s", raw_response)
+
+            # 4. Parse the JSON string response from the LLM
+            try:
+                return parse_llm_json(raw_response)
+
+            except json.JSONDecodeError as json_err:
+                log.error(
+                    "FAILED TO PARSE JSON. Error: %s\nRaw Response was: %s", json_err, raw_response,
+                    exc_info=True
+                )
+                raise HTTPException(status_code=500, detail=f"Error parsing LLM response. Raw: " + raw_response)
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            log.error(
+                "AN UNEXPECTED ERROR OCCURRED. Error Type: %s\nError: %s", type(e), e,
+                exc_info=True
+            )
+            raise HTTPException(status_code=500, detail=f"Error during query: {str(e)}")
+
+    return app
@@ -6,11 +6,17 @@ import json
 # FIX 1: Corrected the URL string
 BACKEND_URL = "http://127.0.0.1:8000"
 
-# FIX 2: Added the proxy bypass configuration
-proxy_config = {
-    "http": None,
-    "https" : None,
-}
+# FIX 2: Bypass the system proxy configuration (trust_env=False)
+# Streamlit reruns this script on every interaction, so the session is cached
+# to reuse one keep-alive connection to the backend across reruns.
+@st.cache_resource
+def get_http_session():
+    session = requests.Session()
+    session.trust_env = False
+    session.headers["Connection"] = "keep-alive"
+    return session
+
+SESSION = get_http_session()
 
 # --- Page Setup ---
 st.set_page_config(page_title="Policy Document Analyzer", layout="wide")
@@ -28,16 +34,17 @@ with col1:
     
     if uploaded_file is not None:
         with st.spinner("Processing document... This may take a moment."):
-            # Prepare file for API request
-            files = {"file": (uploaded_file.name, uploaded_file.getvalue(), "application/pdf")}
+            # Prepare file for API request: pass the file object itself rather than a
+            # getvalue() copy; rewind it since the same object is reused across reruns
+            uploaded_file.seek(0)
+            files = {"file": (uploaded_file.name, uploaded_file, "application/pdf")}
             
             try:
                 # Send to backend's /upload endpoint
-                response = requests.post(
+                response = SESSION.post(
                     f"{BACKEND_URL}/upload", 
                     files=files, 
-                    timeout=600,
-                    proxies=proxy_config  # <-- FIX 2 Applied here
+                    timeout=600
                 )
                 
                 if response.status_code == 200:
@@ -62,10 +69,9 @@ with col2:
                 with st.spinner("Analyzing..."):
                     try:
                         # Send to backend's /query endpoint
-                        response = requests.post(
+                        response = SESSION.post(
                             f"{BACKEND_URL}/query", 
-                            json={"question": query},
-                            proxies=proxy_config  # <-- FIX 2 Applied here
+                            json={"question": query}
                         )
                         
                         if response.status_code == 200: